@@ -0,0 +1,41 @@
+"""
+Gunicorn settings for running the AI Learning Tutor across several cores
+
+    gunicorn -c gunicorn_conf.py main:app
+"""
+
+import os
+
+bind = f"{os.getenv('SERVER_HOST', '0.0.0.0')}:{os.getenv('SERVER_PORT', '8000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Ollama serializes on the GPU, so more workers than parallel model slots only adds queueing
+workers = min(8, (os.cpu_count() or 1) * 2 + 1)
+if os.getenv("OLLAMA_NUM_PARALLEL"):
+    workers = max(1, min(workers, int(os.environ["OLLAMA_NUM_PARALLEL"])))
+
+# Import main once in the master so init_database() and model selection run once, pre-fork
+preload_app = True
+
+# Heartbeat files on tmpfs where available (Linux); macOS has no /dev/shm
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"
+
+timeout = 120
+
+
+# Pin each worker to one CPU so its caches stay warm (Linux only; macOS has no sched_setaffinity)
+pin_worker_cpus = hasattr(os, "sched_setaffinity") and os.getenv("PIN_WORKER_CPUS", "true").lower() != "false"
+
+
+def post_fork(server, worker):
+    """SQLite connections must not cross a fork, so each worker opens its own pool"""
+    import main
+    main.init_connection_pool()
+    
+    if pin_worker_cpus:
+        # Round-robin over the CPUs this process may use; worker.age keeps respawned workers spread out
+        cpus = sorted(os.sched_getaffinity(0))
+        cpu = cpus[worker.age % len(cpus)]
+        os.sched_setaffinity(0, {cpu})
+        server.log.info("Worker %s pinned to CPU %s", worker.pid, cpu)
@@ -8,24 +8,39 @@ AI Learning Tutor - SPEED OPTIMIZED for M3 MacBook
 - Model warm-up optimization
 """
 
-import json
 import sqlite3
-from datetime import datetime
+from dataclasses import dataclass, field
 from typing import List, Optional, Dict, Any
 import uuid
+import hashlib
+import secrets
 import random
 import asyncio
+import bisect
+import functools
+from functools import cached_property
 import time
 import platform
-import hashlib
+import statistics
 import os
-
+import queue
+import threading
+import atexit
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+
+import httpx
+import orjson
 import uvicorn
+import xxhash
+from cachetools import TTLCache
+from itsdangerous import BadSignature, URLSafeSerializer
 from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, StreamingResponse
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 
 # Import ollama
 try:
@@ -37,22 +52,38 @@ except ImportError:
     OLLAMA_AVAILABLE = False
     ollama = None
 
+# POSIX file locks keep Gunicorn workers from pulling the same model at once; Windows has no fcntl
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 # Check for macOS and Metal support
+# platform caches uname(), so this costs no fork/exec of sysctl at import
 IS_MACOS = platform.system() == "Darwin"
-HAS_M_CHIP = False
+HAS_M_CHIP = IS_MACOS and platform.machine() == "arm64"
 if IS_MACOS:
-    try:
-        import subprocess
-        chip_info = subprocess.check_output(['sysctl', '-n', 'machdep.cpu.brand_string']).decode().strip()
-        HAS_M_CHIP = 'Apple' in chip_info
-        print(f"🍎 Detected: {chip_info}")
-        if HAS_M_CHIP:
-            print("🚀 M-series chip detected - optimizing for SPEED")
-    except:
-        pass
+    print(f"🍎 Detected: macOS on {platform.machine()}")
+    if HAS_M_CHIP:
+        print("🚀 M-series chip detected - optimizing for SPEED")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm the model in the background so uvicorn accepts connections immediately"""
+    tasks = [
+        asyncio.create_task(content_generator.warm_up_model()),
+        asyncio.create_task(content_generator.keep_warm()),
+        asyncio.create_task(pull_quantized_model()),
+        asyncio.create_task(flush_progress_writes()),
+    ]
+    yield
+    for task in tasks:
+        if not task.done():
+            task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
 
 # Initialize FastAPI app
-app = FastAPI(title="AI Learning Tutor - Speed Optimized", version="5.0.0")
+app = FastAPI(title="AI Learning Tutor - Speed Optimized", version="5.0.0", lifespan=lifespan)
 
 # CORS configuration
 app.add_middleware(
@@ -66,14 +97,205 @@ app.add_middleware(
 # Global variables
 ollama_client = None
 fast_model = None
+# Ollama unloads idle models after 5 minutes by default; hold the weights in memory between requests
+MODEL_KEEP_ALIVE = "1h"
+KEEP_WARM_INTERVAL = 1800
+# Model calls arriving within the window are dispatched together (Ollama runs them in parallel up to OLLAMA_NUM_PARALLEL)
+MODEL_BATCH_SIZE = 8
+MODEL_BATCH_WINDOW = 0.02
+# Batches are formed from similar-length prompts (short < 256 <= medium < 1024 <= long estimated tokens)
+PROMPT_BUCKETS = (256, 1024)
 DB_PATH = "learning_tutor.db"
+DB_POOL_SIZE = 8
+DB_CACHED_STATEMENTS = 256
+SECTION_CACHE_TTL_DAYS = 30
+
+# Connections are long-lived so SQLite's per-connection page cache survives across requests
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+)
+
+# In-process memo of parsed cache rows, keyed by topic/content hash (guarded by _memo_lock).
+# Each worker has its own, so the TTL bounds how long one serves a section another worker regenerated
+MEMO_TTL = 60
+_guide_cache = TTLCache(maxsize=256, ttl=MEMO_TTL)
+_section_cache = TTLCache(maxsize=1024, ttl=MEMO_TTL)
+# Aggregated progress per (session_id, topic_hash). Flushes invalidate it; the short TTL bounds staleness from other workers
+_progress_cache = TTLCache(maxsize=10_000, ttl=2)
+# Bumped per key by every flush, so a read that overlapped a flush knows not to cache what it saw.
+# Entries outlive any single read, which is all the comparison needs
+_progress_versions = TTLCache(maxsize=10_000, ttl=60)
+_memo_lock = threading.Lock()
+
+# Hot statements live in module constants so every call hits the per-connection statement cache
+SQL_SELECT_STUDY_GUIDE = "SELECT structure, model_used, ai_generated, created_at FROM study_guides WHERE topic_hash = ?"
+SQL_SELECT_SECTION_CONTENT = (
+    "SELECT content, model_used, generation_time, ai_generated, created_at FROM section_content WHERE content_hash = ?"
+)
+# Progress is aggregated in SQLite: one row back with the per-section JSON object and the totals
+SQL_SELECT_PROGRESS = (
+    "SELECT json_group_object(section_index, json_object("
+    "'completed', json(CASE WHEN completed THEN 'true' ELSE 'false' END), "
+    "'study_time', COALESCE(study_time, 0), 'completed_at', completed_at)), "
+    "COALESCE(SUM(CASE WHEN completed THEN 1 ELSE 0 END), 0), COALESCE(SUM(study_time), 0) "
+    "FROM user_progress WHERE session_id = ? AND topic_hash = ?"
+)
+SQL_INSERT_SESSION = "INSERT INTO user_sessions (session_id) VALUES (?)"
+SQL_SELECT_SESSION = "SELECT 1 FROM user_sessions WHERE session_id = ?"
+
+SQL_INSERT_SECTION_CONTENT = (
+    "INSERT OR REPLACE INTO section_content (topic, section_title, section_index, difficulty, content_hash, content, model_used, generation_time, ai_generated) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+# completed_at is stamped by SQLite (UTC) from the completed flag, so rows carry no Python datetimes
+SQL_UPSERT_PROGRESS = (
+    "INSERT INTO user_progress (session_id, topic, topic_hash, section_index, completed, completed_at, study_time) "
+    "VALUES (?1, ?2, ?3, ?4, ?5, CASE WHEN ?5 THEN CURRENT_TIMESTAMP END, ?6) "
+    "ON CONFLICT(session_id, topic_hash, section_index) DO UPDATE SET "
+    "completed = excluded.completed, completed_at = excluded.completed_at, study_time = study_time + excluded.study_time"
+)
+
+# Progress ticks are buffered and flushed in one transaction per batch
+PROGRESS_FLUSH_ROWS = 500
+PROGRESS_FLUSH_INTERVAL = 0.25
+PROGRESS_READ_TIMEOUT = 2.0
+progress_writes: "asyncio.Queue[tuple]" = asyncio.Queue()
+# Buffered rows per (session_id, topic_hash), so a progress read waits only for its own writes
+_pending_progress: Dict[tuple, int] = {}
+_progress_landed: Dict[tuple, asyncio.Event] = {}
+
+_pool: "queue.Queue[sqlite3.Connection]" = queue.Queue(maxsize=DB_POOL_SIZE)
+_write_conn: Optional[sqlite3.Connection] = None
+_write_lock = threading.Lock()
+
+def _open_connection() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=DB_CACHED_STATEMENTS)
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def init_connection_pool():
+    """Open the reader pool and the single dedicated writer connection"""
+    global _write_conn
+    
+    while not _pool.empty():
+        _pool.get_nowait().close()
+    for _ in range(DB_POOL_SIZE):
+        _pool.put_nowait(_open_connection())
+    
+    if _write_conn is not None:
+        _write_conn.close()
+    _write_conn = _open_connection()
+
+@contextmanager
+def get_conn():
+    """Borrow a pooled read connection"""
+    conn = _pool.get()
+    try:
+        yield conn
+    finally:
+        _pool.put(conn)
+
+@contextmanager
+def get_write_conn():
+    """Use the single writer connection (one writer avoids SQLITE_BUSY under WAL)"""
+    with _write_lock:
+        try:
+            yield _write_conn
+        except Exception:
+            _write_conn.rollback()
+            raise
+
+async def run_db(func, *args):
+    """Run a blocking SQLite helper on the default thread pool instead of the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args))
+
+# Cache tables whose hash column holds a raw 16-byte digest, and how to recompute it from a row
+_DIGEST_COLUMNS = {
+    "study_guides": ("topic_hash", lambda row: CacheKey.of(row["topic"], row["difficulty"]).topic_digest),
+    "section_content": ("content_hash", lambda row: CacheKey.of(row["topic"], row["difficulty"], row["section_title"]).content_digest),
+}
+
+def _has_text_hash_column(cursor, table: str, column: str) -> bool:
+    return any(row[1] == column and row[2].upper() == "TEXT" for row in cursor.execute(f"PRAGMA table_info({table})"))
+
+def _copy_legacy_cache_rows(cursor, table: str):
+    """Move rows from a pre-BLOB cache table into the rebuilt one, recomputing each digest"""
+    column, digest_for = _DIGEST_COLUMNS[table]
+    legacy = f"{table}_legacy"
+    names = [row[1] for row in cursor.execute(f"PRAGMA table_info({legacy})") if row[1] not in ("id", column)]
+    rows = cursor.execute(f"SELECT {', '.join(names)} FROM {legacy} ORDER BY id").fetchall()
+    cursor.executemany(
+        f"INSERT OR IGNORE INTO {table} ({', '.join(names)}, {column}) VALUES ({', '.join('?' * (len(names) + 1))})",
+        [(*row, digest_for(dict(zip(names, row)))) for row in rows]
+    )
+    cursor.execute(f"DROP TABLE {legacy}")
+    print(f"💾 Migrated {len(rows)} {table} rows to BLOB digests")
+
+def _remap_legacy_progress_hashes(cursor):
+    """Rewrite user_progress rows keyed by the old MD5 topic hash to the xxh3 hash the API now returns"""
+    # Either hash is 32 hex chars, so a settings marker records that the remap already ran
+    if cursor.execute("SELECT 1 FROM app_settings WHERE key = 'progress_hash'").fetchone():
+        return
+    remapped = 0
+    # Difficulty isn't stored on progress rows, so try each one the old hash could have covered
+    for (topic,) in cursor.execute("SELECT DISTINCT topic FROM user_progress").fetchall():
+        for difficulty in ("easy", "medium", "hard"):
+            legacy = hashlib.md5(f"{topic.lower().strip()}_{difficulty}".encode()).hexdigest()
+            current = CacheKey.of(topic, difficulty).topic_hash
+            # A section already tracked under the new hash absorbs its legacy row: study time adds up, completion sticks
+            remapped += cursor.execute(
+                "UPDATE user_progress SET study_time = user_progress.study_time + legacy.study_time, "
+                "completed = user_progress.completed OR legacy.completed, "
+                "completed_at = COALESCE(user_progress.completed_at, legacy.completed_at) "
+                "FROM user_progress AS legacy WHERE user_progress.topic_hash = ?1 AND legacy.topic_hash = ?2 "
+                "AND legacy.session_id = user_progress.session_id AND legacy.section_index = user_progress.section_index",
+                (current, legacy)
+            ).rowcount
+            cursor.execute(
+                "DELETE FROM user_progress AS legacy WHERE topic_hash = ?2 AND EXISTS ("
+                "SELECT 1 FROM user_progress WHERE topic_hash = ?1 "
+                "AND session_id = legacy.session_id AND section_index = legacy.section_index)",
+                (current, legacy)
+            )
+            remapped += cursor.execute(
+                "UPDATE user_progress SET topic_hash = ? WHERE topic_hash = ?", (current, legacy)
+            ).rowcount
+    cursor.execute("INSERT OR IGNORE INTO app_settings (key, value) VALUES ('progress_hash', 'xxh3_128')")
+    if remapped:
+        print(f"💾 Migrated {remapped} user_progress rows to xxh3 topic hashes")
+
+# Cache writes are fire-and-forget on one thread (a single writer avoids SQLite lock contention)
+_write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+atexit.register(_write_executor.shutdown, wait=True)
+
+def _log_write_failure(future):
+    if future.exception():
+        print(f"❌ Background write failed: {future.exception()}")
+
+def queue_write(func, *args):
+    """Submit a blocking SQLite write without making the response wait for it"""
+    future = _write_executor.submit(func, *args)
+    future.add_done_callback(_log_write_failure)
+    return future
 
 # Database initialization (same as before)
 def init_database():
     """Initialize SQLite database with all necessary tables"""
+    global _session_serializer
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
     
+    # Cache tables created before hashes were stored as BLOB digests are set aside and rebuilt
+    legacy_tables = [table for table, (column, _) in _DIGEST_COLUMNS.items() if _has_text_hash_column(cursor, table, column)]
+    for table in legacy_tables:
+        cursor.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
+    
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS user_sessions (
             session_id TEXT PRIMARY KEY,
@@ -83,12 +305,19 @@ def init_database():
         )
     """)
     
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS app_settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    """)
+    
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS study_guides (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             topic TEXT NOT NULL,
             difficulty TEXT NOT NULL,
-            topic_hash TEXT NOT NULL UNIQUE,
+            topic_hash BLOB NOT NULL,
             structure TEXT NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             model_used TEXT,
@@ -103,7 +332,7 @@ def init_database():
             section_title TEXT NOT NULL,
             section_index INTEGER NOT NULL,
             difficulty TEXT NOT NULL,
-            content_hash TEXT NOT NULL UNIQUE,
+            content_hash BLOB NOT NULL,
             content TEXT NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             model_used TEXT,
@@ -127,22 +356,64 @@ def init_database():
         )
     """)
     
+    # One progress row per session/topic/section so updates can upsert; older trees could hold duplicates
+    if not cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_up_session_section'").fetchone():
+        cursor.execute(
+            "DELETE FROM user_progress WHERE id NOT IN "
+            "(SELECT MIN(id) FROM user_progress GROUP BY session_id, topic_hash, section_index)"
+        )
+        # Its (session_id, topic_hash) prefix also serves get_progress, so no separate index is needed
+        cursor.execute("CREATE UNIQUE INDEX idx_up_session_section ON user_progress(session_id, topic_hash, section_index)")
+        cursor.execute("ANALYZE user_progress")
+    
+    # 16-byte digests halve the index size of the 32-char hex keys they replace
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_sg_hash ON study_guides(topic_hash)")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_sc_hash ON section_content(content_hash)")
+    
+    for table in legacy_tables:
+        _copy_legacy_cache_rows(cursor, table)
+    _remap_legacy_progress_hashes(cursor)
+    
+    # section_content is the persistent cross-session cache; expire old generations at startup
+    expired = cursor.execute(
+        "DELETE FROM section_content WHERE created_at < datetime('now', ?)", (f"-{SECTION_CACHE_TTL_DAYS} days",)
+    ).rowcount
+    if expired:
+        print(f"🧹 Expired {expired} cached sections older than {SECTION_CACHE_TTL_DAYS} days")
+    
+    _session_serializer = URLSafeSerializer(_load_session_secret(cursor), salt="session")
+    
     conn.commit()
+    # Refresh planner statistics only for tables that changed enough to need it
+    conn.execute("PRAGMA optimize")
     conn.close()
+    init_connection_pool()
     print("💾 Database initialized successfully")
 
 # Pydantic Models
-class StudyGuideRequest(BaseModel):
+class NormalizedRequest(BaseModel):
+    """Strips free-text fields once at validation and exposes the request's normalized cache key"""
+    
+    @field_validator("topic", "section_title", mode="before", check_fields=False)
+    @classmethod
+    def strip_text(cls, v):
+        return v.strip() if isinstance(v, str) else v
+    
+    @cached_property
+    def cache_key(self) -> "CacheKey":
+        return CacheKey.of(self.topic, self.difficulty, getattr(self, "section_title", ""))
+
+class StudyGuideRequest(NormalizedRequest):
     topic: str = Field(..., min_length=2, max_length=100)
     difficulty: str = Field(default="medium", pattern="^(easy|medium|hard)$")
 
-class SectionContentRequest(BaseModel):
+class SectionContentRequest(NormalizedRequest):
     topic: str = Field(..., min_length=2, max_length=100)
     section_title: str = Field(..., min_length=3, max_length=200)
     section_index: int = Field(..., ge=0, le=10)
     difficulty: str = Field(default="medium", pattern="^(easy|medium|hard)$")
 
-class RegenerateContentRequest(BaseModel):
+class RegenerateContentRequest(NormalizedRequest):
     topic: str = Field(..., min_length=2, max_length=100)
     section_title: str = Field(..., min_length=3, max_length=200)
     section_index: int = Field(..., ge=0, le=10)
@@ -156,349 +427,132 @@ class ProgressUpdateRequest(BaseModel):
     study_time: float = Field(default=0, ge=0)
 
 # Utility Functions
+@dataclass(frozen=True)
+class CacheKey:
+    """Normalized cache identity, built once per request so hashes aren't recomputed per helper"""
+    topic: str
+    difficulty: str
+    section_title: str = ""
+    
+    @classmethod
+    @functools.lru_cache(maxsize=4096)
+    def of(cls, topic: str, difficulty: str, section_title: str = "") -> "CacheKey":
+        # Memoized, so each distinct input is normalized and hashed once per worker
+        return cls(topic.lower().strip(), difficulty, section_title.lower().strip())
+    
+    # Cache keys only, not security-sensitive: xxh3_128 is a 16-byte digest like MD5 but much cheaper.
+    # The raw digests are what SQLite stores; the hex form is what the API exposes.
+    @cached_property
+    def topic_digest(self) -> bytes:
+        return xxhash.xxh3_128_digest(f"{self.topic}_{self.difficulty}".encode())
+    
+    @cached_property
+    def content_digest(self) -> bytes:
+        return xxhash.xxh3_128_digest(f"{self.topic}_{self.section_title}_{self.difficulty}".encode())
+    
+    @property
+    def topic_hash(self) -> str:
+        return self.topic_digest.hex()
+    
+    @property
+    def content_hash(self) -> str:
+        return self.content_digest.hex()
+
 def get_topic_hash(topic: str, difficulty: str) -> str:
-    return hashlib.md5(f"{topic.lower().strip()}_{difficulty}".encode()).hexdigest()
+    return CacheKey.of(topic, difficulty).topic_hash
 
 def get_content_hash(topic: str, section_title: str, difficulty: str) -> str:
-    return hashlib.md5(f"{topic.lower().strip()}_{section_title.lower().strip()}_{difficulty}".encode()).hexdigest()
+    return CacheKey.of(topic, difficulty, section_title).content_hash
+
+SESSION_COOKIE_MAX_AGE = 30*24*60*60
+# Session ids are signed into the cookie, so a valid cookie is trusted without a database lookup
+_session_serializer: Optional[URLSafeSerializer] = None
+
+def _load_session_secret(cursor) -> str:
+    """SECRET_KEY from the environment, otherwise one generated on first start and kept in the database"""
+    secret = os.getenv("SECRET_KEY")
+    if secret:
+        return secret
+    # OR IGNORE: concurrent first starts (several workers) converge on whichever secret landed first
+    cursor.execute("INSERT OR IGNORE INTO app_settings (key, value) VALUES ('session_secret', ?)", (secrets.token_hex(32),))
+    return cursor.execute("SELECT value FROM app_settings WHERE key = 'session_secret'").fetchone()[0]
+
+def _is_legacy_session_format(cookie: str) -> bool:
+    try:
+        uuid.UUID(cookie)
+        return True
+    except ValueError:
+        return False
+
+def _session_exists(session_id: str) -> bool:
+    with get_conn() as conn:
+        return conn.execute(SQL_SELECT_SESSION, (session_id,)).fetchone() is not None
+
+def _set_session_cookie(response: Response, session_id: str):
+    response.set_cookie(
+        "session_id", _session_serializer.dumps(session_id),
+        max_age=SESSION_COOKIE_MAX_AGE, httponly=True, samesite="lax"
+    )
 
-def get_or_create_session(request: Request, response: Response) -> str:
-    session_id = request.cookies.get("session_id")
-    
-    if not session_id:
-        session_id = str(uuid.uuid4())
-        response.set_cookie("session_id", session_id, max_age=30*24*60*60)
-        
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO user_sessions (session_id) VALUES (?)", (session_id,))
+def _insert_session(session_id: str):
+    with get_write_conn() as conn:
+        conn.execute(SQL_INSERT_SESSION, (session_id,))
         conn.commit()
-        conn.close()
-        print(f"🆕 Created new session: {session_id[:8]}...")
-    
-    return session_id
 
-# SPEED-OPTIMIZED Content Generator
-class SpeedOptimizedContentGenerator:
-    def __init__(self):
-        self.timeout = 20  # Reduced timeout for speed
-        self.model_warmed_up = False
-    
-    async def warm_up_model(self):
-        """Warm up the model for faster subsequent generations"""
-        if ollama_client and fast_model and not self.model_warmed_up:
-            try:
-                print(f"🔥 Warming up model: {fast_model}")
-                start_time = time.time()
-                
-                # Quick warm-up generation
-                response = ollama_client.chat(
-                    model=fast_model,
-                    messages=[{"role": "user", "content": "Hello"}],
-                    options={"num_predict": 10, "temperature": 0.1}
-                )
-                
-                elapsed = time.time() - start_time
-                print(f"🔥 Model warmed up in {elapsed:.1f}s")
-                self.model_warmed_up = True
-            except Exception as e:
-                print(f"⚠️ Warm-up failed: {e}")
-    
-    def get_cached_study_guide(self, topic: str, difficulty: str) -> Optional[Dict]:
-        topic_hash = get_topic_hash(topic, difficulty)
-        
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT structure, model_used, ai_generated, created_at FROM study_guides WHERE topic_hash = ?",
-            (topic_hash,)
-        )
-        result = cursor.fetchone()
-        conn.close()
-        
-        if result:
-            print(f"💾 Found cached study guide for: {topic} ({difficulty})")
-            structure = json.loads(result[0])
-            return {"structure": structure, "cached": True}
-        
-        return None
-    
-    def save_study_guide(self, topic: str, difficulty: str, structure: Dict, model_used: str = None, ai_generated: bool = True):
-        topic_hash = get_topic_hash(topic, difficulty)
-        
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute(
-                "INSERT INTO study_guides (topic, difficulty, topic_hash, structure, model_used, ai_generated) VALUES (?, ?, ?, ?, ?, ?)",
-                (topic, difficulty, topic_hash, json.dumps(structure), model_used, ai_generated)
-            )
-            conn.commit()
-            print(f"💾 Saved study guide: {topic} ({difficulty})")
-        except sqlite3.IntegrityError:
-            print(f"💾 Study guide already exists: {topic} ({difficulty})")
-        finally:
-            conn.close()
-    
-    def get_cached_section_content(self, topic: str, section_title: str, difficulty: str) -> Optional[Dict]:
-        content_hash = get_content_hash(topic, section_title, difficulty)
-        
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT content, model_used, generation_time, ai_generated, created_at FROM section_content WHERE content_hash = ?",
-            (content_hash,)
-        )
-        result = cursor.fetchone()
-        conn.close()
-        
-        if result:
-            print(f"💾 Found cached content for: {section_title}")
-            return {
-                "content": result[0],
-                "model_used": result[1],
-                "generation_time": f"{result[2]:.1f}s" if result[2] else "cached",
-                "ai_generated": result[3],
-                "cached": True
-            }
-        
-        return None
+async def get_or_create_session(request: Request, response: Response) -> str:
+    cookie = request.cookies.get("session_id")
     
-    def save_section_content(self, topic: str, section_title: str, section_index: int, difficulty: str, 
-                           content: str, model_used: str = None, generation_time: float = 0, ai_generated: bool = True):
-        content_hash = get_content_hash(topic, section_title, difficulty)
-        
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
+    if cookie:
         try:
-            cursor.execute(
-                "INSERT OR REPLACE INTO section_content (topic, section_title, section_index, difficulty, content_hash, content, model_used, generation_time, ai_generated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                (topic, section_title, section_index, difficulty, content_hash, content, model_used, generation_time, ai_generated)
-            )
-            conn.commit()
-            print(f"💾 Saved section content: {section_title}")
-        except Exception as e:
-            print(f"❌ Failed to save content: {e}")
-        finally:
-            conn.close()
+            return _session_serializer.loads(cookie)
+        except BadSignature:
+            # Cookies issued before sessions were signed hold the bare id. Honour it only for a session that was
+            # actually issued; the lookup happens once, since the cookie is re-issued signed
+            if _is_legacy_session_format(cookie) and await run_db(_session_exists, cookie):
+                _set_session_cookie(response, cookie)
+                return cookie
     
-    def delete_cached_content(self, topic: str, section_title: str, difficulty: str):
-        content_hash = get_content_hash(topic, section_title, difficulty)
-        
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM section_content WHERE content_hash = ?", (content_hash,))
-        conn.commit()
-        conn.close()
-        print(f"🗑️ Deleted cached content for: {section_title}")
+    session_id = str(uuid.uuid4())
+    _set_session_cookie(response, session_id)
     
-    async def generate_study_guide_structure(self, topic: str, difficulty: str):
-        """SPEED-OPTIMIZED study guide generation"""
-        
-        # Check cache first (instant)
-        cached = self.get_cached_study_guide(topic, difficulty)
-        if cached:
-            return cached["structure"]
-        
-        # Generate new with SPEED optimization
-        if ollama_client and fast_model:
-            try:
-                print(f"⚡ SPEED-generating study guide: {topic} ({difficulty})")
-                await self.warm_up_model()
-                
-                start_time = time.time()
-                
-                # SPEED-OPTIMIZED prompt (much shorter)
-                prompt = f"""Create 6 study sections for "{topic}" ({difficulty} level).
-
-JSON format:
-{{
-  "topic": "{topic}",
-  "difficulty": "{difficulty}",
-  "overview": "Brief overview...",
-  "estimated_time": "2-3 hours",
-  "sections": [
-    {{"id": 1, "title": "Introduction to {topic}", "overview": "Basic concepts...", "learning_objectives": ["Learn basics", "Understand concepts", "Apply knowledge"], "estimated_time": "30 min"}},
-    {{"id": 2, "title": "Core Principles", "overview": "Key principles...", "learning_objectives": ["Master principles", "Understand relationships", "Apply concepts"], "estimated_time": "40 min"}},
-    {{"id": 3, "title": "Practical Applications", "overview": "Real-world uses...", "learning_objectives": ["See examples", "Understand implementation", "Practice skills"], "estimated_time": "45 min"}},
-    {{"id": 4, "title": "Advanced Concepts", "overview": "Complex topics...", "learning_objectives": ["Advanced features", "Complex scenarios", "Expert concepts"], "estimated_time": "50 min"}},
-    {{"id": 5, "title": "Best Practices", "overview": "Standards and practices...", "learning_objectives": ["Industry standards", "Avoid mistakes", "Professional practices"], "estimated_time": "35 min"}},
-    {{"id": 6, "title": "Future Directions", "overview": "Next steps...", "learning_objectives": ["Future trends", "Advanced resources", "Continued learning"], "estimated_time": "20 min"}}
-  ]
-}}
-
-ONLY JSON output:"""
-
-                response = ollama_client.chat(
-                    model=fast_model,
-                    messages=[{"role": "user", "content": prompt}],
-                    options={
-                        "temperature": 0.4,  # Lower for speed
-                        "num_predict": 800,  # Much lower for speed
-                    }
-                )
-                
-                elapsed = time.time() - start_time
-                print(f"⚡ SPEED structure generation: {elapsed:.1f}s")
-                
-                content = response['message']['content'].strip()
-                structure = self.extract_json_safely(content)
-                
-                if structure and 'sections' in structure:
-                    print(f"✅ Generated FAST structure with {len(structure['sections'])} sections")
-                    self.save_study_guide(topic, difficulty, structure, fast_model, True)
-                    return structure
-                    
-            except Exception as e:
-                print(f"⚠️ SPEED generation failed: {e}")
-        
-        # FAST fallback
-        structure = self.get_speed_fallback_structure(topic, difficulty)
-        self.save_study_guide(topic, difficulty, structure, "speed_template", False)
-        return structure
+    # Recorded on the writer thread; nothing in the request depends on the row existing yet
+    queue_write(_insert_session, session_id)
+    print(f"🆕 Created new session: {session_id[:8]}...")
     
-    async def generate_section_content(self, topic: str, section_title: str, section_index: int, difficulty: str, force_regenerate: bool = False):
-        """SPEED-OPTIMIZED section content generation"""
-        
-        # Check cache first (instant)
-        if not force_regenerate:
-            cached = self.get_cached_section_content(topic, section_title, difficulty)
-            if cached:
-                return {
-                    "topic": topic,
-                    "section_title": section_title,
-                    "section_index": section_index,
-                    "difficulty": difficulty,
-                    "content": cached["content"],
-                    "ai_generated": cached["ai_generated"],
-                    "model_used": cached["model_used"],
-                    "generation_time": cached["generation_time"],
-                    "cached": True
-                }
-        else:
-            self.delete_cached_content(topic, section_title, difficulty)
-        
-        # Generate new with SPEED optimization
-        if ollama_client and fast_model:
-            try:
-                print(f"⚡ SPEED-generating content for: {section_title}")
-                await self.warm_up_model()
-                
-                start_time = time.time()
-                
-                # SPEED-OPTIMIZED prompt (much shorter and focused)
-                prompt = f"""Generate educational content for:
-
-Topic: {topic}
-Section: {section_title}
-Level: {difficulty}
-
-Create focused content with:
-
-## Overview
-Brief explanation of {section_title} in {topic} context.
-
-## Key Concepts  
-- Main principle 1
-- Main principle 2
-- Main principle 3
-
-## Practical Examples
-1. Example 1: Real application
-2. Example 2: Use case
-3. Example 3: Implementation
-
-## Important Points
-- Critical insight 1
-- Critical insight 2  
-- Critical insight 3
-
-## Next Steps
-How this connects to broader {topic} learning.
-
-Keep concise but informative. Focus on {difficulty} level appropriateness."""
+    return session_id
 
-                response = ollama_client.chat(
-                    model=fast_model,
-                    messages=[{"role": "user", "content": prompt}],
-                    options={
-                        "temperature": 0.5,  # Lower for consistency and speed
-                        "num_predict": 1200,  # Much lower for speed (vs 3500)
-                    }
-                )
-                
-                elapsed = time.time() - start_time
-                print(f"⚡ SPEED content generation: {elapsed:.1f}s")
-                
-                content = response['message']['content'].strip()
-                
-                if content and len(content) > 150:
-                    print(f"✅ Generated FAST content ({len(content)} chars)")
-                    
-                    self.save_section_content(topic, section_title, section_index, difficulty, content, fast_model, elapsed, True)
-                    
-                    return {
-                        "topic": topic,
-                        "section_title": section_title,
-                        "section_index": section_index,
-                        "difficulty": difficulty,
-                        "content": content,
-                        "ai_generated": True,
-                        "model_used": fast_model,
-                        "generation_time": f"{elapsed:.1f}s",
-                        "cached": False
-                    }
-                    
-            except Exception as e:
-                print(f"⚠️ SPEED generation failed: {e}")
-        
-        # FAST fallback
-        content_data = self.get_speed_section_content(topic, section_title, section_index, difficulty)
-        self.save_section_content(topic, section_title, section_index, difficulty, content_data["content"], "speed_template", 0, False)
-        return content_data
+@dataclass
+class WarmupProfile:
+    """Latencies of the first few generations, to show when a cold model has settled"""
+    max_samples: int = 20
+    window: int = 5
+    latencies: List[float] = field(default_factory=list)
+    stabilized_at: Optional[int] = None
     
-    def extract_json_safely(self, content: str):
-        """Fast JSON extraction"""
-        try:
-            return json.loads(content)
-        except:
-            pass
-        
-        try:
-            start = content.find('{')
-            end = content.rfind('}') + 1
-            if start != -1 and end > start:
-                return json.loads(content[start:end])
-        except:
-            pass
+    def record(self, seconds: float):
+        if len(self.latencies) >= self.max_samples:
+            return
+        self.latencies.append(seconds)
         
-        return None
+        # Stable once the rolling stddev drops below 10% of the rolling mean
+        if self.stabilized_at is None and len(self.latencies) >= self.window:
+            recent = self.latencies[-self.window:]
+            mean = statistics.fmean(recent)
+            if mean > 0 and statistics.pstdev(recent) < 0.1 * mean:
+                self.stabilized_at = len(self.latencies)
     
-    def get_speed_fallback_structure(self, topic: str, difficulty: str):
-        """FAST fallback structure"""
+    def summary(self) -> Dict[str, Any]:
         return {
-            "topic": topic,
-            "difficulty": difficulty,
-            "overview": f"Comprehensive {difficulty}-level study guide for {topic}",
-            "estimated_time": "2-3 hours",
-            "sections": [
-                {"id": 1, "title": f"Introduction to {topic}", "overview": f"Fundamentals of {topic}", "learning_objectives": [f"Understand {topic} basics", "Learn key concepts", "See practical applications"], "estimated_time": "30 min"},
-                {"id": 2, "title": "Core Principles", "overview": f"Essential principles of {topic}", "learning_objectives": ["Master core principles", "Understand relationships", "Apply knowledge"], "estimated_time": "40 min"},
-                {"id": 3, "title": "Practical Applications", "overview": f"Real-world applications of {topic}", "learning_objectives": ["Explore examples", "Understand implementation", "Practice skills"], "estimated_time": "45 min"},
-                {"id": 4, "title": "Advanced Concepts", "overview": f"Advanced topics in {topic}", "learning_objectives": ["Advanced features", "Complex scenarios", "Expert concepts"], "estimated_time": "50 min"},
-                {"id": 5, "title": "Best Practices", "overview": f"Professional standards for {topic}", "learning_objectives": ["Industry standards", "Avoid mistakes", "Professional practices"], "estimated_time": "35 min"},
-                {"id": 6, "title": "Future Directions", "overview": f"Future developments in {topic}", "learning_objectives": ["Future trends", "Advanced resources", "Continued learning"], "estimated_time": "20 min"}
-            ]
+            "samples": len(self.latencies),
+            "first_latency": self.latencies[0] if self.latencies else None,
+            "latencies": [round(latency, 3) for latency in self.latencies],
+            "stabilized": self.stabilized_at is not None,
+            "stabilized_after_requests": self.stabilized_at
         }
-    
-    def get_speed_section_content(self, topic: str, section_title: str, section_index: int, difficulty: str):
-        """FAST, unique fallback content per section"""
-        
-        # Speed-optimized unique content per section
-        content_map = {
-            0: f"""## {section_title}
+
+# Speed-optimized unique fallback content per section (plain str.format templates)
+_SECTION_TEMPLATES: tuple[str, ...] = (
+    """## {section_title}
 
 ### Overview
 {section_title} introduces the fundamental concepts of {topic}. This section establishes the foundation for your learning journey.
@@ -523,7 +577,7 @@ Keep concise but informative. Focus on {difficulty} level appropriateness."""
 ### Next Steps
 This foundation prepares you for deeper exploration of {topic} in subsequent sections.""",
 
-            1: f"""## {section_title}
+    """## {section_title}
 
 ### Deep Dive into Fundamentals
 {section_title} explores the essential mechanisms and principles that make {topic} work effectively.
@@ -553,7 +607,7 @@ This foundation prepares you for deeper exploration of {topic} in subsequent sec
 ### Integration
 These core concepts connect directly to practical applications and advanced topics you'll encounter later.""",
 
-            2: f"""## {section_title}
+    """## {section_title}
 
 ### Real-World Implementation
 {section_title} bridges theory and practice, showing how {topic} concepts work in real applications.
@@ -584,7 +638,7 @@ These core concepts connect directly to practical applications and advanced topi
 ### Skills Development
 This section builds practical skills you can immediately apply in your own work with {topic}.""",
 
-            3: f"""## {section_title}
+    """## {section_title}
 
 ### Advanced Understanding
 {section_title} delves into sophisticated aspects of {topic} that require deeper knowledge and analytical thinking.
@@ -614,7 +668,7 @@ This section builds practical skills you can immediately apply in your own work
 ### Mastery Development
 Success here indicates developing expertise in {topic} and readiness for professional-level applications.""",
 
-            4: f"""## {section_title}
+    """## {section_title}
 
 ### Professional Standards and Excellence
 {section_title} focuses on the established standards, proven methods, and professional practices that define quality work in {topic}.
@@ -649,7 +703,7 @@ Success here indicates developing expertise in {topic} and readiness for profess
 ### Career Integration
 These standards and practices form the foundation of successful professional careers in {topic}.""",
 
-            5: f"""## {section_title}
+    """## {section_title}
 
 ### Future Learning and Development
 {section_title} prepares you for continued growth and advanced learning in the evolving field of {topic}.
@@ -684,17 +738,742 @@ These standards and practices form the foundation of successful professional car
 - Future opportunities depend on continued learning
 
 ### Long-Term Success
-Your {topic} journey continues beyond this study guide. These resources and approaches will support your ongoing development and contribution to the field."""
-        }
-        
-        # Select content with fallback
-        selected_content = content_map.get(section_index, content_map[0])
-        
-        return {
-            "topic": topic,
-            "section_title": section_title,
-            "section_index": section_index,
-            "difficulty": difficulty,
+Your {topic} journey continues beyond this study guide. These resources and approaches will support your ongoing development and contribution to the field.""",
+)
+
+@functools.lru_cache(maxsize=512)
+def render_section_template(section_index: int, topic: str, section_title: str) -> str:
+    """Format only the selected template; repeat fallbacks are served from the LRU"""
+    if not 0 <= section_index < len(_SECTION_TEMPLATES):
+        section_index = 0
+    return _SECTION_TEMPLATES[section_index].format(topic=topic, section_title=section_title)
+
+# Prompt scaffolds are byte-identical across requests so Ollama/llama.cpp can reuse the prefix's KV cache;
+# everything request-specific goes in the trailing user message
+STRUCTURE_SYSTEM_PROMPT = (
+    'Output JSON matching schema: {"topic": str, "difficulty": str, "overview": str, '
+    '"estimated_time": str, "sections": [{"id": int, "title": str, "overview": str, '
+    '"learning_objectives": [3 str], "estimated_time": str}]} for the study sections requested.'
+)
+
+SECTION_SYSTEM_PROMPT = """Generate educational content for the topic, section and level given by the user.
+
+Create focused content with:
+
+## Overview
+Brief explanation of the section in the context of the topic.
+
+## Key Concepts
+- Main principle 1
+- Main principle 2
+- Main principle 3
+
+## Practical Examples
+1. Example 1: Real application
+2. Example 2: Use case
+3. Example 3: Implementation
+
+## Important Points
+- Critical insight 1
+- Critical insight 2
+- Critical insight 3
+
+## Next Steps
+How this connects to broader learning of the topic.
+
+Keep concise but informative. Focus on appropriateness for the given level."""
+
+# Decode time is linear in output tokens, so lighter section shapes get smaller num_predict budgets
+SECTION_BUDGETS: Dict[str, int] = {
+    "summary": 400,
+    "review": 400,
+    "introduction": 600,
+    "overview": 600,
+    "example": 900,
+    "exercise": 900,
+    "practice": 900,
+}
+DEFAULT_SECTION_BUDGET = 800
+# Sections use ## subheadings, so only a new top-level heading means the model has run past the section
+SECTION_STOP = ["\n# "]
+
+def section_budget(section_title: str) -> int:
+    title = section_title.lower()
+    return next((budget for keyword, budget in SECTION_BUDGETS.items() if keyword in title), DEFAULT_SECTION_BUDGET)
+
+def prompt_bucket(messages: List[Dict]) -> int:
+    # ~4 characters per token is close enough to bucket by; no tokenizer runs in this process
+    tokens = sum(len(message["content"]) for message in messages) // 4
+    return bisect.bisect_right(PROMPT_BUCKETS, tokens)
+
+# SPEED-OPTIMIZED Content Generator
+class SpeedOptimizedContentGenerator:
+    def __init__(self):
+        self.timeout = 20  # Reduced timeout for speed
+        self._background_tasks = set()
+        self._inflight_guides: Dict[bytes, asyncio.Future] = {}
+        self._inflight_sections: Dict[bytes, asyncio.Future] = {}
+        # Bumped whenever a section is invalidated, so a generation started earlier can tell its result is stale
+        self._section_generations: Dict[bytes, int] = {}
+        self._model_buckets: tuple = ()
+        self._model_ready: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        # Set once the model is warm; the lock stops concurrent cold requests all pinging Ollama
+        self._warmup_event = asyncio.Event()
+        self._warmup_lock = asyncio.Lock()
+        # Trade first-request latency for faster pod readiness (like llama.cpp --no-warmup)
+        self._skip_warmup = (
+            os.getenv("AI_TUTOR_NO_WARMUP") == "1" or os.getenv("ENABLE_MODEL_WARMUP", "true").lower() == "false"
+        )
+        self.warmup_seconds: Optional[float] = None
+        self.warmup_profiles = {"structure": WarmupProfile(), "section": WarmupProfile()}
+    
+    async def warm_up_model(self):
+        """Warm up the model for faster subsequent generations"""
+        if self._skip_warmup or self._warmup_event.is_set() or not (ollama_client and fast_model):
+            return
+        
+        async with self._warmup_lock:
+            if self._warmup_event.is_set():
+                return
+            try:
+                print(f"🔥 Warming up model: {fast_model}")
+                start_time = time.time()
+                
+                # Loading the weights is the cost being paid here; one decoded token is enough
+                await ollama_client.chat(
+                    model=fast_model,
+                    messages=[{"role": "user", "content": "ok"}],
+                    options={"num_predict": 1, "temperature": 0.1},
+                    keep_alive=MODEL_KEEP_ALIVE
+                )
+                
+                elapsed = time.time() - start_time
+                print(f"🔥 Model warmed up in {elapsed:.1f}s")
+                self.warmup_seconds = elapsed
+                self._warmup_event.set()
+            except Exception as e:
+                print(f"⚠️ Warm-up failed: {e}")
+    
+    async def keep_warm(self):
+        """Refresh Ollama's keep-alive before it expires so an idle model is never reloaded"""
+        while True:
+            await asyncio.sleep(KEEP_WARM_INTERVAL)
+            if not (ollama_client and fast_model):
+                continue
+            try:
+                await ollama_client.chat(
+                    model=fast_model,
+                    messages=[{"role": "user", "content": "."}],
+                    options={"num_predict": 1},
+                    keep_alive=MODEL_KEEP_ALIVE
+                )
+            except Exception as e:
+                print(f"⚠️ Keep-warm ping failed: {e}")
+    
+    def reset_warmup(self):
+        """Forget the warm state after switching models"""
+        self._warmup_event.clear()
+        self.warmup_seconds = None
+    
+    def warmup_report(self) -> Dict[str, Any]:
+        return {
+            "warmup_skipped": self._skip_warmup,
+            "warmed_up": self._warmup_event.is_set(),
+            "warmup_seconds": self.warmup_seconds,
+            "profiles": {name: profile.summary() for name, profile in self.warmup_profiles.items()}
+        }
+    
+    async def get_cached_study_guide(self, key: CacheKey) -> Optional[Dict]:
+        topic_hash = key.topic_digest
+        
+        with _memo_lock:
+            cached = _guide_cache.get(topic_hash)
+        if cached is not None:
+            return cached
+        
+        return await run_db(self._read_study_guide, key)
+    
+    def _read_study_guide(self, key: CacheKey) -> Optional[Dict]:
+        topic_hash = key.topic_digest
+        
+        with get_conn() as conn:
+            result = conn.execute(SQL_SELECT_STUDY_GUIDE, (topic_hash,)).fetchone()
+        
+        if result:
+            print(f"💾 Found cached study guide for: {key.topic} ({key.difficulty})")
+            structure = orjson.loads(result[0])
+            cached = {"structure": structure, "cached": True}
+            with _memo_lock:
+                _guide_cache[topic_hash] = cached
+            return cached
+        
+        return None
+    
+    def save_study_guide(self, key: CacheKey, topic: str, structure: Dict, model_used: str = None, ai_generated: bool = True):
+        topic_hash = key.topic_digest
+        difficulty = key.difficulty
+        
+        with get_write_conn() as conn:
+            try:
+                conn.execute(
+                    "INSERT INTO study_guides (topic, difficulty, topic_hash, structure, model_used, ai_generated) VALUES (?, ?, ?, ?, ?, ?)",
+                    (topic, difficulty, topic_hash, orjson.dumps(structure).decode(), model_used, ai_generated)
+                )
+                conn.commit()
+                print(f"💾 Saved study guide: {topic} ({difficulty})")
+            except sqlite3.IntegrityError:
+                conn.rollback()
+                print(f"💾 Study guide already exists: {topic} ({difficulty})")
+    
+    async def get_cached_section_content(self, key: CacheKey) -> Optional[Dict]:
+        content_hash = key.content_digest
+        
+        with _memo_lock:
+            cached = _section_cache.get(content_hash)
+        if cached is not None:
+            return cached
+        
+        return await run_db(self._read_section_content, key)
+    
+    def _read_section_content(self, key: CacheKey) -> Optional[Dict]:
+        content_hash = key.content_digest
+        
+        with get_conn() as conn:
+            result = conn.execute(SQL_SELECT_SECTION_CONTENT, (content_hash,)).fetchone()
+        
+        if result:
+            print(f"💾 Found cached content for: {key.section_title}")
+            cached = self._cached_section_entry(*result[:4])
+            with _memo_lock:
+                _section_cache[content_hash] = cached
+            return cached
+        
+        return None
+    
+    @staticmethod
+    def _cached_section_entry(content: str, model_used: str, generation_time: float, ai_generated: bool) -> Dict:
+        return {
+            "content": content,
+            "model_used": model_used,
+            "generation_time": f"{generation_time:.1f}s" if generation_time else "cached",
+            "ai_generated": ai_generated,
+            "cached": True
+        }
+    
+    def persist_study_guide(self, key: CacheKey, topic: str, structure: Dict, model_used: str = None, ai_generated: bool = True):
+        """Serve the guide from memory right away and write it to SQLite in the background"""
+        with _memo_lock:
+            _guide_cache.setdefault(key.topic_digest, {"structure": structure, "cached": True})
+        queue_write(self.save_study_guide, key, topic, structure, model_used, ai_generated)
+    
+    def section_generation(self, key: CacheKey) -> int:
+        return self._section_generations.get(key.content_digest, 0)
+    
+    def persist_section_content(self, key: CacheKey, topic: str, section_title: str, section_index: int,
+                              content: str, model_used: str = None, generation_time: float = 0, ai_generated: bool = True,
+                              batch: Optional[List[tuple]] = None, generation: Optional[int] = None):
+        """Serve the section from memory right away and write it to SQLite in the background.
+        When a batch list is given the row is collected there for one flush_section_batch() flush.
+        When a generation is given, content invalidated since that generation started is dropped instead."""
+        if generation is not None and generation != self.section_generation(key):
+            print(f"⏭️ Skipped stale content for: {section_title}")
+            return
+        with _memo_lock:
+            _section_cache[key.content_digest] = self._cached_section_entry(content, model_used, generation_time, ai_generated)
+        if batch is not None:
+            batch.append((
+                self.section_generation(key),
+                (topic, section_title, section_index, key.difficulty, key.content_digest, content, model_used, generation_time, ai_generated)
+            ))
+            return
+        queue_write(self.save_section_content, key, topic, section_title, section_index, content, model_used, generation_time, ai_generated)
+    
+    def save_section_content(self, key: CacheKey, topic: str, section_title: str, section_index: int,
+                           content: str, model_used: str = None, generation_time: float = 0, ai_generated: bool = True):
+        content_hash = key.content_digest
+        difficulty = key.difficulty
+        
+        try:
+            with get_write_conn() as conn:
+                conn.execute(
+                    SQL_INSERT_SECTION_CONTENT,
+                    (topic, section_title, section_index, difficulty, content_hash, content, model_used, generation_time, ai_generated)
+                )
+                conn.commit()
+            print(f"💾 Saved section content: {section_title}")
+        except Exception as e:
+            print(f"❌ Failed to save content: {e}")
+    
+    def flush_section_batch(self, batch: List[tuple]):
+        """Queue one save for the rows a batch collected, leaving out any invalidated since"""
+        rows = [row for generation, row in batch if generation == self._section_generations.get(row[4], 0)]
+        if rows:
+            queue_write(self.save_section_contents, rows)
+    
+    def save_section_contents(self, rows: List[tuple]):
+        """Save many sections in one transaction (one commit instead of one per section)"""
+        try:
+            with get_write_conn() as conn:
+                conn.executemany(SQL_INSERT_SECTION_CONTENT, rows)
+                conn.commit()
+            print(f"💾 Saved {len(rows)} sections in one batch")
+        except Exception as e:
+            print(f"❌ Failed to save content batch: {e}")
+    
+    def invalidate_section_content(self, key: CacheKey):
+        """Drop a section from the memo now and from SQLite on the writer thread"""
+        self._section_generations[key.content_digest] = self.section_generation(key) + 1
+        with _memo_lock:
+            _section_cache.pop(key.content_digest, None)
+        queue_write(self.delete_cached_content, key)
+    
+    def delete_cached_content(self, key: CacheKey):
+        content_hash = key.content_digest
+        
+        with get_write_conn() as conn:
+            conn.execute("DELETE FROM section_content WHERE content_hash = ?", (content_hash,))
+            conn.commit()
+        print(f"🗑️ Deleted cached content for: {key.section_title}")
+    
+    async def _call_model(self, messages: List[Dict], options: Dict, **extra):
+        """Queue one chat request for the micro-batcher and wait for its response"""
+        loop = asyncio.get_running_loop()
+        if self._dispatcher is None or self._dispatcher.done() or self._dispatcher.get_loop() is not loop:
+            self._model_buckets = tuple(deque() for _ in range(len(PROMPT_BUCKETS) + 1))
+            self._model_ready = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch_model_calls())
+        
+        future = loop.create_future()
+        request = {"model": fast_model, "messages": messages, "options": options, "keep_alive": MODEL_KEEP_ALIVE, **extra}
+        self._model_buckets[prompt_bucket(messages)].append((loop.time(), request, future))
+        self._model_ready.set()
+        return await future
+    
+    def _next_model_batch(self, now: float):
+        """Take a batch from a full bucket, else from the bucket whose oldest request has waited out the window"""
+        pending = [bucket for bucket in self._model_buckets if bucket]
+        bucket = next((bucket for bucket in pending if len(bucket) >= MODEL_BATCH_SIZE), None)
+        if bucket is None:
+            bucket = min(pending, key=lambda bucket: bucket[0][0])
+            wait = bucket[0][0] + MODEL_BATCH_WINDOW - now
+            if wait > 0:
+                return None, wait
+        return [bucket.popleft() for _ in range(min(len(bucket), MODEL_BATCH_SIZE))], 0
+    
+    async def _dispatch_model_calls(self):
+        """Issue up to MODEL_BATCH_SIZE similar-length requests together, waiting at most MODEL_BATCH_WINDOW"""
+        loop = asyncio.get_running_loop()
+        while True:
+            if not any(self._model_buckets):
+                self._model_ready.clear()
+                await self._model_ready.wait()
+            
+            batch, wait = self._next_model_batch(loop.time())
+            if batch is None:
+                await asyncio.sleep(wait)
+                continue
+            
+            # Each batch runs on its own so requests arriving meanwhile are never held behind its slowest call
+            task = asyncio.create_task(self._run_model_batch(batch))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+    
+    async def _run_model_batch(self, batch: List[tuple]):
+        # Callers that were cancelled while queued don't need a generation
+        await asyncio.gather(*(self._resolve_model_call(request, future) for _, request, future in batch if not future.done()))
+    
+    @staticmethod
+    async def _resolve_model_call(request: Dict, future: asyncio.Future):
+        # Each caller is released as soon as its own response is back, not when the batch's slowest call is
+        try:
+            result = await ollama_client.chat(**request)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+    
+    async def _singleflight(self, inflight: Dict[bytes, asyncio.Future], digest: bytes, make_coro):
+        """Let concurrent identical requests share one in-flight generation instead of each hitting the GPU"""
+        future = inflight.get(digest)
+        if future is not None:
+            return await asyncio.shield(future)
+        
+        future = asyncio.get_running_loop().create_future()
+        inflight[digest] = future
+        try:
+            result = await make_coro()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else was waiting
+            raise
+        finally:
+            inflight.pop(digest, None)
+    
+    async def generate_study_guide_structure(self, topic: str, difficulty: str, prefetch_sections: bool = True,
+                                             key: Optional[CacheKey] = None):
+        """SPEED-OPTIMIZED study guide generation"""
+        key = key or CacheKey.of(topic, difficulty)
+        return await self._singleflight(
+            self._inflight_guides, key.topic_digest,
+            lambda: self._generate_study_guide_structure(topic, difficulty, prefetch_sections, key)
+        )
+    
+    async def _generate_study_guide_structure(self, topic: str, difficulty: str, prefetch_sections: bool, key: CacheKey):
+        # Check cache first (instant)
+        cached = await self.get_cached_study_guide(key)
+        if cached:
+            return cached["structure"]
+        
+        # Generate new with SPEED optimization
+        if ollama_client and fast_model:
+            try:
+                print(f"⚡ SPEED-generating study guide: {topic} ({difficulty})")
+                await self.warm_up_model()
+                
+                start_time = time.time()
+                
+                # Compact schema instead of a pre-filled example: fewer prefill tokens,
+                # and format="json" makes Ollama emit parseable JSON
+                response = await self._call_model(
+                    [
+                        {"role": "system", "content": STRUCTURE_SYSTEM_PROMPT},
+                        {"role": "user", "content": f'6 study sections on "{topic}" ({difficulty} level).'},
+                    ],
+                    {
+                        "temperature": 0.4,  # Lower for speed
+                        "num_predict": 800,  # Much lower for speed
+                    },
+                    format="json"
+                )
+                
+                elapsed = time.time() - start_time
+                print(f"⚡ SPEED structure generation: {elapsed:.1f}s")
+                self.warmup_profiles["structure"].record(elapsed)
+                
+                content = response['message']['content'].strip()
+                structure = self.extract_json_safely(content)
+                
+                if structure and 'sections' in structure:
+                    print(f"✅ Generated FAST structure with {len(structure['sections'])} sections")
+                    self.persist_study_guide(key, topic, structure, fast_model, True)
+                    if prefetch_sections:
+                        self.prefetch_sections(topic, difficulty, structure)
+                    return structure
+                    
+            except Exception as e:
+                print(f"⚠️ SPEED generation failed: {e}")
+        
+        # FAST fallback
+        structure = self.get_speed_fallback_structure(topic, difficulty)
+        self.persist_study_guide(key, topic, structure, "speed_template", False)
+        return structure
+    
+    async def generate_section_content(self, topic: str, section_title: str, section_index: int, difficulty: str,
+                                       force_regenerate: bool = False, batch: Optional[List[tuple]] = None,
+                                       key: Optional[CacheKey] = None):
+        """SPEED-OPTIMIZED section content generation"""
+        key = key or CacheKey.of(topic, difficulty, section_title)
+        if force_regenerate:
+            # A regenerate must produce new content, so it never joins (or lends itself to) a shared flight
+            return await self._generate_section_content(topic, section_title, section_index, difficulty, True, batch, key)
+        section = await self._singleflight(
+            self._inflight_sections, key.content_digest,
+            lambda: self._generate_section_content(topic, section_title, section_index, difficulty, force_regenerate, batch, key)
+        )
+        # Content is keyed by title, so a shared flight may have been started for a same-titled section elsewhere in the guide
+        if section["section_index"] != section_index:
+            section = {**section, "section_index": section_index}
+        return section
+    
+    async def _generate_section_content(self, topic: str, section_title: str, section_index: int, difficulty: str,
+                                        force_regenerate: bool, batch: Optional[List[tuple]], key: CacheKey):
+        # Check cache first (instant)
+        if not force_regenerate:
+            cached = await self.get_cached_section_content(key)
+            if cached:
+                return {
+                    "topic": topic,
+                    "section_title": section_title,
+                    "section_index": section_index,
+                    "difficulty": difficulty,
+                    "content": cached["content"],
+                    "ai_generated": cached["ai_generated"],
+                    "model_used": cached["model_used"],
+                    "generation_time": cached["generation_time"],
+                    "cached": True
+                }
+        else:
+            self.invalidate_section_content(key)
+        generation = self.section_generation(key)
+        
+        # Generate new with SPEED optimization
+        if ollama_client and fast_model:
+            try:
+                print(f"⚡ SPEED-generating content for: {section_title}")
+                await self.warm_up_model()
+                
+                start_time = time.time()
+                
+                response = await self._call_model(
+                    self.build_section_messages(topic, section_title, difficulty),
+                    {
+                        "temperature": 0.5,  # Lower for consistency and speed
+                        "num_predict": section_budget(section_title),
+                        "stop": SECTION_STOP,
+                    }
+                )
+                
+                elapsed = time.time() - start_time
+                print(f"⚡ SPEED content generation: {elapsed:.1f}s")
+                self.warmup_profiles["section"].record(elapsed)
+                
+                content = response['message']['content'].strip()
+                
+                if content and len(content) > 150:
+                    print(f"✅ Generated FAST content ({len(content)} chars)")
+                    
+                    self.persist_section_content(key, topic, section_title, section_index, content, fast_model, elapsed, True, batch, generation)
+                    
+                    return {
+                        "topic": topic,
+                        "section_title": section_title,
+                        "section_index": section_index,
+                        "difficulty": difficulty,
+                        "content": content,
+                        "ai_generated": True,
+                        "model_used": fast_model,
+                        "generation_time": f"{elapsed:.1f}s",
+                        "cached": False
+                    }
+                    
+            except Exception as e:
+                print(f"⚠️ SPEED generation failed: {e}")
+        
+        # FAST fallback
+        content_data = self.get_speed_section_content(topic, section_title, section_index, difficulty)
+        self.persist_section_content(key, topic, section_title, section_index, content_data["content"], "speed_template", 0, False, batch, generation)
+        return content_data
+    
+    def build_section_messages(self, topic: str, section_title: str, difficulty: str) -> List[Dict]:
+        """SPEED-OPTIMIZED prompt: constant instructions first, only the request-specific fields last"""
+        return [
+            {"role": "system", "content": SECTION_SYSTEM_PROMPT},
+            {"role": "user", "content": f"Topic: {topic}\nSection: {section_title}\nLevel: {difficulty}"},
+        ]
+    
+    async def stream_section(self, topic: str, section_title: str, section_index: int, difficulty: str,
+                             force_regenerate: bool = False, key: Optional[CacheKey] = None,
+                             meta: Optional[Dict] = None):
+        """Yield section content as the model produces it, then cache the full text.
+        
+        When given, meta is filled with model_used/generation_time/ai_generated/cached once the stream ends.
+        """
+        
+        key = key or CacheKey.of(topic, difficulty, section_title)
+        meta = {} if meta is None else meta
+        
+        if force_regenerate:
+            self.invalidate_section_content(key)
+        else:
+            cached = await self.get_cached_section_content(key)
+            if cached:
+                meta.update(
+                    model_used=cached["model_used"], generation_time=cached["generation_time"],
+                    ai_generated=cached["ai_generated"], cached=True
+                )
+                yield cached["content"]
+                return
+            
+            # A prefetch of this section is already generating it; share that rather than spend a second model slot
+            shared = self._inflight_sections.get(key.content_digest)
+            if shared is not None:
+                try:
+                    section = await asyncio.shield(shared)
+                except Exception:
+                    section = None  # that flight failed, so stream our own below
+                if section is not None:
+                    meta.update(
+                        model_used=section["model_used"], generation_time=section["generation_time"],
+                        ai_generated=section["ai_generated"], cached=section["cached"]
+                    )
+                    yield section["content"]
+                    return
+        
+        # Register the stream like any other flight, so a prefetch that reaches this section joins it instead
+        flight = None
+        if not force_regenerate and key.content_digest not in self._inflight_sections:
+            flight = asyncio.get_running_loop().create_future()
+            self._inflight_sections[key.content_digest] = flight
+        
+        tokens = []
+        try:
+            async for token in self._stream_section(topic, section_title, section_index, difficulty, key, meta):
+                tokens.append(token)
+                yield token
+        finally:
+            if flight is not None:
+                if self._inflight_sections.get(key.content_digest) is flight:
+                    del self._inflight_sections[key.content_digest]
+                if "model_used" in meta and not meta.get("incomplete"):
+                    flight.set_result({
+                        "topic": topic,
+                        "section_title": section_title,
+                        "section_index": section_index,
+                        "difficulty": difficulty,
+                        "content": "".join(tokens).strip(),
+                        "ai_generated": meta["ai_generated"],
+                        "model_used": meta["model_used"],
+                        "generation_time": meta["generation_time"],
+                        "cached": False
+                    })
+                else:
+                    flight.set_exception(RuntimeError(f"stream for {section_title} ended early"))
+                    flight.exception()  # mark retrieved when nobody joined
+    
+    async def _stream_section(self, topic: str, section_title: str, section_index: int, difficulty: str,
+                              key: CacheKey, meta: Dict):
+        generation = self.section_generation(key)
+        
+        if ollama_client and fast_model:
+            print(f"⚡ SPEED-streaming content for: {section_title}")
+            await self.warm_up_model()
+            
+            start_time = time.time()
+            buffer = []
+            failed = False
+            try:
+                stream = await ollama_client.chat(
+                    model=fast_model,
+                    messages=self.build_section_messages(topic, section_title, difficulty),
+                    options={
+                        "temperature": 0.5,
+                        "num_predict": section_budget(section_title),
+                        "stop": SECTION_STOP,
+                    },
+                    stream=True,
+                    keep_alive=MODEL_KEEP_ALIVE
+                )
+                async for chunk in stream:
+                    token = chunk['message']['content']
+                    if token:
+                        buffer.append(token)
+                        yield token
+            except Exception as e:
+                print(f"⚠️ SPEED streaming failed: {e}")
+                failed = True
+            
+            content = "".join(buffer).strip()
+            # A stream cut off mid-way is a truncated section; never cache it as a complete generation
+            if not failed and len(content) > 150:
+                elapsed = time.time() - start_time
+                print(f"✅ Streamed FAST content ({len(content)} chars) in {elapsed:.1f}s")
+                self.warmup_profiles["section"].record(elapsed)
+                self.persist_section_content(key, topic, section_title, section_index, content, fast_model, elapsed, True, generation=generation)
+                meta.update(model_used=fast_model, generation_time=f"{elapsed:.1f}s", ai_generated=True, cached=False)
+                return
+            if buffer:
+                # Partial output already reached the client; don't append a template to it
+                meta.update(
+                    model_used=fast_model, generation_time=f"{time.time() - start_time:.1f}s", ai_generated=True,
+                    cached=False, incomplete=True
+                )
+                return
+        
+        content_data = self.get_speed_section_content(topic, section_title, section_index, difficulty)
+        self.persist_section_content(key, topic, section_title, section_index, content_data["content"], "speed_template", 0, False, generation=generation)
+        meta.update(
+            model_used=content_data["model_used"], generation_time=content_data["generation_time"],
+            ai_generated=False, cached=False
+        )
+        yield content_data["content"]
+    
+    async def generate_all_sections(self, topic: str, difficulty: str, titles: List[str]):
+        """Generate every section concurrently so Ollama can overlap them (OLLAMA_NUM_PARALLEL)"""
+        batch = []
+        
+        def flush_finished(_=None):
+            # Save sections as they finish rather than after the slowest one, so none outlives its memo entry
+            # unsaved; sections finishing in the same loop iteration still share one transaction
+            if batch:
+                self.flush_section_batch(batch[:])
+                batch.clear()
+        
+        tasks = [
+            asyncio.ensure_future(self.generate_section_content(topic, title, index, difficulty, batch=batch))
+            for index, title in enumerate(titles)
+        ]
+        for task in tasks:
+            task.add_done_callback(flush_finished)
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            # Sections that finished are persisted even if a sibling failed or the prefetch was cancelled
+            flush_finished()
+    
+    def prefetch_sections(self, topic: str, difficulty: str, structure: Dict):
+        """Warm the section cache in the background while the user reads section 1"""
+        titles = [section.get("title", "") for section in structure.get("sections", [])]
+        if not titles:
+            return
+        
+        print(f"🚀 Prefetching {len(titles)} sections for: {topic} ({difficulty})")
+        task = asyncio.create_task(self.generate_all_sections(topic, difficulty, titles))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+    
+    def extract_json_safely(self, content: str):
+        """Fast JSON extraction (defensive fallback; structure calls already request format="json")"""
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            pass
+        
+        # index/rindex raise ValueError when no braces exist, as does orjson on a bad slice
+        try:
+            return orjson.loads(content[content.index('{'):content.rindex('}') + 1])
+        except ValueError:
+            pass
+        
+        return None
+    
+    def get_speed_fallback_structure(self, topic: str, difficulty: str):
+        """FAST fallback structure"""
+        return {
+            "topic": topic,
+            "difficulty": difficulty,
+            "overview": f"Comprehensive {difficulty}-level study guide for {topic}",
+            "estimated_time": "2-3 hours",
+            "sections": [
+                {"id": 1, "title": f"Introduction to {topic}", "overview": f"Fundamentals of {topic}", "learning_objectives": [f"Understand {topic} basics", "Learn key concepts", "See practical applications"], "estimated_time": "30 min"},
+                {"id": 2, "title": "Core Principles", "overview": f"Essential principles of {topic}", "learning_objectives": ["Master core principles", "Understand relationships", "Apply knowledge"], "estimated_time": "40 min"},
+                {"id": 3, "title": "Practical Applications", "overview": f"Real-world applications of {topic}", "learning_objectives": ["Explore examples", "Understand implementation", "Practice skills"], "estimated_time": "45 min"},
+                {"id": 4, "title": "Advanced Concepts", "overview": f"Advanced topics in {topic}", "learning_objectives": ["Advanced features", "Complex scenarios", "Expert concepts"], "estimated_time": "50 min"},
+                {"id": 5, "title": "Best Practices", "overview": f"Professional standards for {topic}", "learning_objectives": ["Industry standards", "Avoid mistakes", "Professional practices"], "estimated_time": "35 min"},
+                {"id": 6, "title": "Future Directions", "overview": f"Future developments in {topic}", "learning_objectives": ["Future trends", "Advanced resources", "Continued learning"], "estimated_time": "20 min"}
+            ]
+        }
+    
+    def get_speed_section_content(self, topic: str, section_title: str, section_index: int, difficulty: str):
+        """FAST, unique fallback content per section"""
+        
+        selected_content = render_section_template(section_index, topic, section_title)
+        
+        return {
+            "topic": topic,
+            "section_title": section_title,
+            "section_index": section_index,
+            "difficulty": difficulty,
             "content": selected_content,
             "ai_generated": False,
             "model_used": "speed_template",
@@ -702,18 +1481,164 @@ Your {topic} journey continues beyond this study guide. These resources and appr
             "cached": False
         }
 
+# Optional llama.cpp backend: point at a running `llama-server` to bypass Ollama entirely
+LLAMACPP_URL = os.getenv("LLAMACPP_URL")
+
+class LlamaCppClient:
+    """Async client for llama-server's OpenAI-compatible API that answers in Ollama's response shape"""
+    
+    def __init__(self, base_url: str):
+        self._http = httpx.AsyncClient(
+            base_url=base_url.rstrip("/"), timeout=120, headers={"Content-Type": "application/json"}
+        )
+    
+    @staticmethod
+    def _payload(model: str, messages: List[Dict], options: Optional[Dict], format: Optional[str]) -> Dict:
+        options = options or {}
+        payload = {"model": model, "messages": messages}
+        if "temperature" in options:
+            payload["temperature"] = options["temperature"]
+        if "num_predict" in options:
+            payload["max_tokens"] = options["num_predict"]
+        if "stop" in options:
+            payload["stop"] = options["stop"]
+        # Reuse the slot's KV cache for the shared system-prompt prefix
+        payload["cache_prompt"] = True
+        if format == "json":
+            payload["response_format"] = {"type": "json_object"}
+        return payload
+    
+    async def chat(self, model: str, messages: List[Dict], options: Optional[Dict] = None,
+                   format: Optional[str] = None, stream: bool = False, **_ignored):
+        # keep_alive has no equivalent: llama-server keeps its single model loaded for its lifetime
+        payload = self._payload(model, messages, options, format)
+        if stream:
+            return self._stream(payload)
+        
+        # orjson encodes straight to bytes; long prompts make stdlib json noticeable here
+        response = await self._http.post("/v1/chat/completions", content=orjson.dumps(payload))
+        response.raise_for_status()
+        return {"message": {"content": orjson.loads(response.content)["choices"][0]["message"]["content"] or ""}}
+    
+    async def _stream(self, payload: Dict):
+        async with self._http.stream("POST", "/v1/chat/completions", content=orjson.dumps({**payload, "stream": True})) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data: ") or line == "data: [DONE]":
+                    continue
+                delta = orjson.loads(line[6:])["choices"][0].get("delta", {})
+                yield {"message": {"content": delta.get("content") or ""}}
+
+# SPEED-FIRST preference (smaller models), with the GGUF file llama-server would load for each
+SPEED_PREFERENCE = {
+    'llama3.2:3b': 'Llama-3.2-3B-Instruct-Q4_K_M.gguf',     # ⚡ 3-8 seconds - Best speed/quality balance
+    'qwen2.5:3b': 'Qwen2.5-3B-Instruct-Q4_K_M.gguf',        # ⚡ 2-6 seconds - Very fast
+    'phi3:mini': 'Phi-3-mini-4k-instruct-Q4_K_M.gguf',      # ⚡ 1-4 seconds - Lightning fast
+    'gemma2:2b': 'gemma-2-2b-it-Q4_K_M.gguf',               # ⚡ 1-3 seconds - Fastest
+    'llama3.2:1b': 'Llama-3.2-1B-Instruct-Q4_K_M.gguf',     # ⚡ 1-2 seconds - Ultra fast
+    'llama3:8b': 'Meta-Llama-3-8B-Instruct-Q4_K_M.gguf',    # 🔥 8-15 seconds - Slower but good quality
+    'codellama:7b': 'CodeLlama-7B-Instruct-Q4_K_M.gguf',    # 🔥 6-12 seconds - Technical content
+    'mixtral:8x7b': 'Mixtral-8x7B-Instruct-Q4_K_M.gguf',    # 🐌 20+ seconds - High quality but slow
+}
+
+def get_llamacpp_model():
+    """Use the model llama-server is serving, named after its GGUF file"""
+    global ollama_client, fast_model
+    
+    try:
+        print(f"⚡ Connecting to llama.cpp server at {LLAMACPP_URL}...")
+        served = [entry["id"] for entry in httpx.get(f"{LLAMACPP_URL.rstrip('/')}/v1/models", timeout=5).json()["data"]]
+        ollama_client = LlamaCppClient(LLAMACPP_URL)
+        print(f"📋 Served models: {served}")
+        
+        for gguf in SPEED_PREFERENCE.values():
+            stem = gguf.lower().removesuffix(".gguf")
+            for model_id in served:
+                if stem in model_id.lower():
+                    fast_model = model_id
+                    print(f"⚡ Selected SPEED model: {fast_model}")
+                    return fast_model
+        
+        fast_model = served[0] if served else None
+        if fast_model:
+            print(f"⚡ Using served model: {fast_model}")
+        return fast_model
+        
+    except Exception as e:
+        print(f"❌ llama.cpp server not reachable: {e}")
+        return None
+
+# Decode is memory-bandwidth bound, so explicitly quantized tags run fastest on unified memory.
+# These are GGUF weight-only formats served by Ollama/llama.cpp (no bitsandbytes-style runtime dequant).
+QUANT_FORMATS = {
+    "q4_K_M": ("q4_k_m", "q5_k_m", "q4_0"),  # ⚡ fastest decode, ~1.8x FP16 tokens/sec
+    "q8_0": ("q8_0", "q5_k_m", "q4_k_m"),    # ⚖️ near-lossless, ~1.4x FP16 tokens/sec
+    "fp16": ("fp16", "q8_0"),                # 🐌 full precision baseline
+}
+_requested_quant = os.getenv("QUANT_FORMAT") or "q4_K_M"
+QUANT_FORMAT = next((name for name in QUANT_FORMATS if name.lower() == _requested_quant.lower()), None)
+if QUANT_FORMAT is None:
+    print(f"⚠️ Unknown QUANT_FORMAT={_requested_quant}, using q4_K_M")
+    QUANT_FORMAT = "q4_K_M"
+QUANT_PREFERENCE = QUANT_FORMATS[QUANT_FORMAT]
+PREFERRED_QUANTIZED_MODEL = f"llama3.2:3b-instruct-{QUANT_FORMAT}"
+PULL_LOCK_PATH = f"{DB_PATH}.pull.lock"
+
+def pick_quantized_variant(base_model: str, available_models: List[str]) -> Optional[str]:
+    """Prefer an installed quantized tag of base_model, falling back to the base tag itself"""
+    variants = [name for name in available_models if name.lower().startswith(base_model.lower())]
+    for quant in QUANT_PREFERENCE:
+        for name in variants:
+            if quant in name.lower():
+                return name
+    return base_model if base_model in available_models else None
+
+def _acquire_pull_lock():
+    """Block until this process holds the model pull lock; closing the returned file releases it"""
+    lock_file = open(PULL_LOCK_PATH, "w")
+    if fcntl:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+    return lock_file
+
+async def pull_quantized_model():
+    """Opt-in (AI_TUTOR_PULL_QUANTIZED=1): fetch llama3.2:3b-instruct-{QUANT_FORMAT} and switch to it"""
+    global fast_model
+    
+    if os.getenv("AI_TUTOR_PULL_QUANTIZED") != "1" or not ollama_client or LLAMACPP_URL:
+        return
+    if fast_model and any(quant in fast_model.lower() for quant in QUANT_PREFERENCE):
+        return
+    
+    try:
+        # Every worker runs this lifespan task: the first downloads, the rest wait and then find the tag already present
+        lock_file = await asyncio.get_running_loop().run_in_executor(None, _acquire_pull_lock)
+        try:
+            print(f"📥 Pulling quantized model: {PREFERRED_QUANTIZED_MODEL}")
+            await ollama_client.pull(PREFERRED_QUANTIZED_MODEL)
+        finally:
+            lock_file.close()
+        fast_model = PREFERRED_QUANTIZED_MODEL
+        content_generator.reset_warmup()
+        print(f"⚡ Switched to quantized model: {fast_model}")
+        await content_generator.warm_up_model()
+    except Exception as e:
+        print(f"⚠️ Quantized model pull failed: {e}")
+
 def get_fast_model():
     """Get the FASTEST model optimized for speed on M3"""
     global ollama_client, fast_model
     
+    if LLAMACPP_URL:
+        return get_llamacpp_model()
+    
     if not OLLAMA_AVAILABLE:
         print("❌ Ollama not available")
         return None
     
     try:
         print("⚡ Connecting for SPEED-optimized model selection...")
-        ollama_client = ollama.Client()
-        models_response = ollama_client.list()
+        models_response = ollama.Client().list()
+        ollama_client = ollama.AsyncClient()
         
         available_models = []
         
@@ -737,21 +1662,10 @@ def get_fast_model():
         
         print(f"📋 Available models: {available_models}")
         
-        # SPEED-FIRST preference (smaller models)
-        speed_preference = [
-            'llama3.2:3b',         # ⚡ 3-8 seconds - Best speed/quality balance
-            'qwen2.5:3b',          # ⚡ 2-6 seconds - Very fast
-            'phi3:mini',           # ⚡ 1-4 seconds - Lightning fast
-            'gemma2:2b',           # ⚡ 1-3 seconds - Fastest
-            'llama3.2:1b',         # ⚡ 1-2 seconds - Ultra fast
-            'llama3:8b',           # 🔥 8-15 seconds - Slower but good quality
-            'codellama:7b',        # 🔥 6-12 seconds - Technical content
-            'mixtral:8x7b',        # 🐌 20+ seconds - High quality but slow
-        ]
-        
-        for model in speed_preference:
-            if model in available_models:
-                fast_model = model
+        for model in SPEED_PREFERENCE:
+            variant = pick_quantized_variant(model, available_models)
+            if variant:
+                fast_model = variant
                 print(f"⚡ Selected SPEED model: {fast_model}")
                 return fast_model
         
@@ -774,6 +1688,12 @@ content_generator = SpeedOptimizedContentGenerator()
 
 if selected_model:
     print(f"✅ Ready with SPEED model: {selected_model}")
+    if LLAMACPP_URL:
+        print("⚙️ llama.cpp backend (recommended: llama-server -c 4096 --parallel 4 --cont-batching -ngl 99)")
+    else:
+        # These are read by the Ollama server, not by this process
+        print(f"⚙️ OLLAMA_NUM_PARALLEL={os.getenv('OLLAMA_NUM_PARALLEL', 'unset')} (recommended: 4 so concurrent sections overlap)")
+        print(f"⚙️ OLLAMA_MAX_LOADED_MODELS={os.getenv('OLLAMA_MAX_LOADED_MODELS', 'unset')} (recommended: 1)")
 else:
     print("⚠️ Running with speed-optimized templates")
 
@@ -799,24 +1719,53 @@ async def health_check():
         "database_initialized": os.path.exists(DB_PATH)
     }
 
+@app.get("/debug/warmup")
+async def warmup_status():
+    """Warm-up state and early generation latencies, so operators can see when latency settles"""
+    return {"fast_model": fast_model, **content_generator.warmup_report()}
+
 @app.post("/api/study-guide")
 async def generate_study_guide(request: StudyGuideRequest, http_request: Request, response: Response):
     """SPEED-OPTIMIZED study guide generation"""
     
-    session_id = get_or_create_session(http_request, response)
-    topic = request.topic.strip()
+    session_id = await get_or_create_session(http_request, response)
+    topic = request.topic
     difficulty = request.difficulty
     
     print(f"⚡ SPEED study guide request: {topic} ({difficulty}) - Session: {session_id[:8]}...")
     
-    structure = await content_generator.generate_study_guide_structure(topic, difficulty)
+    structure = await content_generator.generate_study_guide_structure(topic, difficulty, key=request.cache_key)
     
     return {
         "topic": topic,
         "difficulty": difficulty,
         "structure": structure,
         "session_id": session_id[:8] + "...",
-        "topic_hash": get_topic_hash(topic, difficulty),
+        "topic_hash": request.cache_key.topic_hash,
+        "speed_optimized": True
+    }
+
+@app.post("/api/study-guide/all-sections")
+async def generate_all_section_content(request: StudyGuideRequest, http_request: Request, response: Response):
+    """Generate (or load) every section of a study guide in one concurrent batch"""
+    
+    session_id = await get_or_create_session(http_request, response)
+    topic = request.topic
+    difficulty = request.difficulty
+    
+    print(f"⚡ SPEED all-sections request: {topic} ({difficulty}) - Session: {session_id[:8]}...")
+    
+    structure = await content_generator.generate_study_guide_structure(
+        topic, difficulty, prefetch_sections=False, key=request.cache_key
+    )
+    titles = [section.get("title", "") for section in structure.get("sections", [])]
+    sections = await content_generator.generate_all_sections(topic, difficulty, titles)
+    
+    return {
+        "topic": topic,
+        "difficulty": difficulty,
+        "topic_hash": request.cache_key.topic_hash,
+        "sections": sections,
         "speed_optimized": True
     }
 
@@ -824,99 +1773,183 @@ async def generate_study_guide(request: StudyGuideRequest, http_request: Request
 async def generate_section_content(request: SectionContentRequest, http_request: Request, response: Response):
     """SPEED-OPTIMIZED section content generation"""
     
-    session_id = get_or_create_session(http_request, response)
-    topic = request.topic.strip()
-    section_title = request.section_title.strip()
+    session_id = await get_or_create_session(http_request, response)
+    topic = request.topic
+    section_title = request.section_title
     section_index = request.section_index
     difficulty = request.difficulty
     
     print(f"⚡ SPEED section content request: {section_title} - Session: {session_id[:8]}...")
     
     content_data = await content_generator.generate_section_content(
-        topic, section_title, section_index, difficulty, force_regenerate=False
+        topic, section_title, section_index, difficulty, force_regenerate=False, key=request.cache_key
     )
     
     return content_data
 
+def sse_event(data: Dict, event: Optional[str] = None) -> bytes:
+    # JSON-encoded data keeps newlines inside tokens from breaking SSE framing
+    prefix = f"event: {event}\n".encode() if event else b""
+    return prefix + b"data: " + orjson.dumps(data) + b"\n\n"
+
+async def section_events(tokens, meta: Dict):
+    """Frame streamed tokens as server-sent events, ending with a done event carrying the metadata"""
+    async for token in tokens:
+        yield sse_event({"token": token})
+    yield sse_event(meta, event="done")
+
+async def event_stream_response(http_request: Request, response: Response, request, force_regenerate: bool) -> StreamingResponse:
+    session_id = await get_or_create_session(http_request, response)
+    print(f"⚡ SPEED stream request: {request.section_title} - Session: {session_id[:8]}...")
+    
+    meta = {}
+    tokens = content_generator.stream_section(
+        request.topic, request.section_title, request.section_index, request.difficulty,
+        force_regenerate=force_regenerate, key=request.cache_key, meta=meta
+    )
+    streaming = StreamingResponse(
+        section_events(tokens, meta),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    # Returning a Response directly bypasses the injected one, so carry the session cookie over
+    for cookie in response.headers.getlist("set-cookie"):
+        streaming.headers.append("set-cookie", cookie)
+    return streaming
+
+@app.post("/api/section/stream")
+async def stream_section_content(request: SectionContentRequest, http_request: Request, response: Response):
+    """Stream section content as server-sent events so the first words arrive immediately"""
+    return await event_stream_response(http_request, response, request, force_regenerate=False)
+
+@app.post("/api/regenerate-content/stream")
+async def stream_regenerated_content(request: RegenerateContentRequest, http_request: Request, response: Response):
+    """Regenerate a section, streaming the fresh content as server-sent events"""
+    return await event_stream_response(http_request, response, request, force_regenerate=True)
+
 @app.post("/api/regenerate-content")
 async def regenerate_section_content(request: RegenerateContentRequest, http_request: Request, response: Response):
     """SPEED-OPTIMIZED content regeneration"""
     
-    session_id = get_or_create_session(http_request, response)
-    topic = request.topic.strip()
-    section_title = request.section_title.strip()
+    session_id = await get_or_create_session(http_request, response)
+    topic = request.topic
+    section_title = request.section_title
     section_index = request.section_index
     difficulty = request.difficulty
     
     print(f"⚡ SPEED regenerate request: {section_title} - Session: {session_id[:8]}...")
     
     content_data = await content_generator.generate_section_content(
-        topic, section_title, section_index, difficulty, force_regenerate=True
+        topic, section_title, section_index, difficulty, force_regenerate=True, key=request.cache_key
     )
     
     return content_data
 
-@app.post("/api/progress/update")
-async def update_progress(request: ProgressUpdateRequest, http_request: Request, response: Response):
-    session_id = get_or_create_session(http_request, response)
+def _write_progress_rows(rows: List[tuple]):
+    # Coalesce ticks for the same section: study time adds up, the latest completion state wins
+    merged = {}
+    for row in rows:
+        slot = (row[0], row[2], row[3])
+        if slot in merged:
+            row = row[:5] + (merged[slot][5] + row[5],)
+        merged[slot] = row
     
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    with get_write_conn() as conn:
+        conn.executemany(SQL_UPSERT_PROGRESS, list(merged.values()))
+        conn.commit()
     
-    cursor.execute(
-        "SELECT id FROM user_progress WHERE session_id = ? AND topic_hash = ? AND section_index = ?",
-        (session_id, request.topic_hash, request.section_index)
-    )
-    existing = cursor.fetchone()
+    with _memo_lock:
+        for session_id, topic_hash, _ in merged:
+            _progress_cache.pop((session_id, topic_hash), None)
+            _progress_versions[(session_id, topic_hash)] = _progress_versions.get((session_id, topic_hash), 0) + 1
+
+async def flush_progress_writes():
+    """Drain buffered progress updates every PROGRESS_FLUSH_INTERVAL or PROGRESS_FLUSH_ROWS, whichever comes first"""
+    rows = []
+    try:
+        while True:
+            rows.append(await progress_writes.get())
+            # Give the batch time to fill unless a full batch is already waiting
+            if progress_writes.qsize() < PROGRESS_FLUSH_ROWS:
+                await asyncio.sleep(PROGRESS_FLUSH_INTERVAL)
+            while len(rows) < PROGRESS_FLUSH_ROWS and not progress_writes.empty():
+                rows.append(progress_writes.get_nowait())
+            
+            batch, rows = rows, []
+            try:
+                await run_db(_write_progress_rows, batch)
+            except Exception as e:
+                print(f"❌ Progress flush failed ({len(batch)} rows): {e}")
+            finally:
+                _mark_progress_landed(batch)
+    finally:
+        # On shutdown, write whatever is still buffered before the process exits
+        while not progress_writes.empty():
+            rows.append(progress_writes.get_nowait())
+        if rows:
+            try:
+                _write_progress_rows(rows)
+                print(f"💾 Flushed {len(rows)} buffered progress updates on shutdown")
+            finally:
+                _mark_progress_landed(rows)
+
+def _mark_progress_landed(rows: List[tuple]):
+    """Release readers of every (session_id, topic_hash) whose buffered rows have all been written"""
+    for row in rows:
+        slot = (row[0], row[2])
+        _pending_progress[slot] -= 1
+        if not _pending_progress[slot]:
+            del _pending_progress[slot]
+            _progress_landed.pop(slot).set()
+
+def _read_progress(session_id: str, topic_hash: str) -> Dict:
+    with get_conn() as conn:
+        progress, completed_sections, total_study_time = conn.execute(SQL_SELECT_PROGRESS, (session_id, topic_hash)).fetchone()
     
-    if existing:
-        cursor.execute(
-            "UPDATE user_progress SET completed = ?, completed_at = ?, study_time = study_time + ? WHERE id = ?",
-            (request.completed, datetime.now() if request.completed else None, request.study_time, existing[0])
-        )
-    else:
-        cursor.execute(
-            "INSERT INTO user_progress (session_id, topic, topic_hash, section_index, completed, completed_at, study_time) VALUES (?, ?, ?, ?, ?, ?, ?)",
-            (session_id, request.topic, request.topic_hash, request.section_index, request.completed, 
-             datetime.now() if request.completed else None, request.study_time)
-        )
+    return {
+        "progress": orjson.loads(progress),
+        "completed_sections": completed_sections,
+        "total_study_time": total_study_time
+    }
+
+@app.post("/api/progress/update")
+async def update_progress(request: ProgressUpdateRequest, http_request: Request, response: Response):
+    session_id = await get_or_create_session(http_request, response)
     
-    conn.commit()
-    conn.close()
+    progress_writes.put_nowait((
+        session_id, request.topic, request.topic_hash, request.section_index, request.completed, request.study_time
+    ))
+    slot = (session_id, request.topic_hash)
+    _pending_progress[slot] = _pending_progress.get(slot, 0) + 1
+    _progress_landed.setdefault(slot, asyncio.Event())
     
     return {"success": True, "message": "Progress updated successfully"}
 
 @app.get("/api/progress/{topic_hash}")
 async def get_progress(topic_hash: str, http_request: Request, response: Response):
-    session_id = get_or_create_session(http_request, response)
+    session_id = await get_or_create_session(http_request, response)
     
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT section_index, completed, study_time, completed_at FROM user_progress WHERE session_id = ? AND topic_hash = ?",
-        (session_id, topic_hash)
-    )
-    progress_data = cursor.fetchall()
-    conn.close()
-    
-    progress = {}
-    total_study_time = 0
-    
-    for section_index, completed, study_time, completed_at in progress_data:
-        progress[section_index] = {
-            "completed": bool(completed),
-            "study_time": study_time or 0,
-            "completed_at": completed_at
-        }
-        total_study_time += study_time or 0
+    # Read-your-writes: let this session's buffered updates for the topic land first, but never hang on a dead flusher
+    landed = _progress_landed.get((session_id, topic_hash))
+    if landed is not None:
+        try:
+            await asyncio.wait_for(landed.wait(), PROGRESS_READ_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"⚠️ Progress flush still pending after {PROGRESS_READ_TIMEOUT}s; reading what has landed")
     
-    completed_sections = sum(1 for p in progress.values() if p["completed"])
+    slot = (session_id, topic_hash)
+    with _memo_lock:
+        cached = _progress_cache.get(slot)
+        version = _progress_versions.get(slot, 0)
+    if cached is not None:
+        return cached
     
-    return {
-        "progress": progress,
-        "completed_sections": completed_sections,
-        "total_study_time": total_study_time
-    }
+    result = await run_db(_read_progress, session_id, topic_hash)
+    with _memo_lock:
+        # A flush that landed mid-read (or writes still buffered) would make this aggregate stale
+        if _progress_versions.get(slot, 0) == version and slot not in _pending_progress:
+            _progress_cache[slot] = result
+    return result
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
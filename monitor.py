@@ -4,18 +4,21 @@ AI Learning Tutor - Performance Monitor
 Monitors API performance, resource usage, and system health
 """
 
+import asyncio
 import time
 import psutil
-import requests
+import httpx
 from datetime import datetime
 import sqlite3
-import json
+import orjson
 
-def check_api_health():
+API_BASE_URL = "http://localhost:8000"
+
+async def check_api_health(client: httpx.AsyncClient):
     """Check API responsiveness"""
     try:
         start_time = time.time()
-        response = requests.get("http://localhost:8000/", timeout=5)
+        response = await client.get("/")
         response_time = (time.time() - start_time) * 1000
         
         return {
@@ -30,11 +33,11 @@ def check_api_health():
             "response_time_ms": None
         }
 
-def check_ai_services():
+async def check_ai_services(client: httpx.AsyncClient):
     """Check AI services status"""
     try:
-        response = requests.get("http://localhost:8000/api/health/ai", timeout=10)
-        return response.json() if response.status_code == 200 else {"error": "AI services unavailable"}
+        response = await client.get("/api/health/ai", timeout=10)
+        return orjson.loads(response.content) if response.status_code == 200 else {"error": "AI services unavailable"}
     except:
         return {"error": "Cannot connect to AI services"}
 
@@ -53,15 +56,12 @@ def get_database_stats():
         conn = sqlite3.connect('data/ai_tutor.db')
         cursor = conn.cursor()
         
-        stats = {}
-        
-        # Count records in each table
+        # Count records in each table (one statement instead of one round-trip per table)
         tables = ['users', 'user_profiles', 'curriculum_modules', 
                  'user_progress', 'quiz_sessions', 'spaced_repetition_schedule']
         
-        for table in tables:
-            cursor.execute(f"SELECT COUNT(*) FROM {table}")
-            stats[f"{table}_count"] = cursor.fetchone()[0]
+        cursor.execute(" UNION ALL ".join(f"SELECT '{table}', COUNT(*) FROM {table}" for table in tables))
+        stats = {f"{table}_count": count for table, count in cursor.fetchall()}
         
         conn.close()
         return stats
@@ -69,19 +69,25 @@ def get_database_stats():
     except Exception as e:
         return {"error": str(e)}
 
-def main():
+async def main():
     """Monitor system and generate report"""
     print("🔍 AI Learning Tutor - System Monitor")
     print("=" * 50)
     
+    # One keep-alive client for both HTTP checks; the checks and the database count run concurrently
+    async with httpx.AsyncClient(base_url=API_BASE_URL, timeout=5.0) as client:
+        api_health, ai_status, db_stats = await asyncio.gather(
+            check_api_health(client),
+            check_ai_services(client),
+            asyncio.to_thread(get_database_stats),
+        )
+    
     # Check API health
-    api_health = check_api_health()
     print(f"🌐 API Status: {api_health['status']}")
     if api_health['response_time_ms']:
         print(f"   Response time: {api_health['response_time_ms']:.2f}ms")
     
     # Check AI services
-    ai_status = check_ai_services()
     print(f"🤖 AI Services:")
     if 'status' in ai_status:
         for service, status in ai_status['status'].items():
@@ -95,7 +101,6 @@ def main():
     print(f"   Disk: {metrics['disk_percent']:.1f}%")
     
     # Database stats
-    db_stats = get_database_stats()
     if 'error' not in db_stats:
         print(f"🗄️ Database:")
         print(f"   Users: {db_stats.get('users_count', 0)}")
@@ -125,4 +130,4 @@ def main():
             print(f"   🚨 {alert}")
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -309,19 +309,7 @@ class SpeedOptimizedAITutor {
         const startTime = Date.now();
         
         try {
-            const response = await fetch(`${this.apiBase}/api/section-content`, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    topic: this.currentTopic,
-                    section_title: this.currentSection.title,
-                    section_index: this.currentSectionIndex,
-                    difficulty: this.settings.difficulty
-                }),
-                credentials: 'include'
-            });
-            
-            const contentData = await response.json();
+            const contentData = await this.streamSectionContent('/api/section/stream');
             const elapsed = (Date.now() - startTime) / 1000;
             
             // Store generation time
@@ -329,7 +317,9 @@ class SpeedOptimizedAITutor {
             
             this.renderSectionContent(contentData, elapsed);
             
-            if (contentData.cached) {
+            if (contentData.incomplete) {
+                this.showIncompleteWarning('loadSectionContent');
+            } else if (contentData.cached) {
                 this.showNotification('💾 Loaded cached content instantly!', 'success');
             } else {
                 this.showNotification(`⚡ Generated in ${elapsed.toFixed(1)}s!`, 'success');
@@ -350,6 +340,85 @@ class SpeedOptimizedAITutor {
         }
     }
     
+    async streamSectionContent(path) {
+        // Render tokens as they arrive over server-sent events; resolves with the final content data
+        const response = await fetch(`${this.apiBase}${path}`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                topic: this.currentTopic,
+                section_title: this.currentSection.title,
+                section_index: this.currentSectionIndex,
+                difficulty: this.settings.difficulty
+            }),
+            credentials: 'include'
+        });
+        
+        if (!response.ok || !response.body) {
+            throw new Error(`Streaming request failed with status ${response.status}`);
+        }
+        
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let pending = '';
+        let content = '';
+        let meta = {};
+        let frame = null;
+        
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            
+            pending += decoder.decode(value, { stream: true });
+            const events = pending.split('\n\n');
+            pending = events.pop();
+            
+            for (const event of events) {
+                const dataLine = event.split('\n').find(line => line.startsWith('data: '));
+                if (!dataLine) continue;
+                
+                const data = JSON.parse(dataLine.slice(6));
+                if (event.startsWith('event: done')) {
+                    meta = data;
+                } else if (data.token) {
+                    content += data.token;
+                    // Coalesce re-renders to one per frame
+                    if (frame === null) {
+                        frame = requestAnimationFrame(() => {
+                            frame = null;
+                            this.renderSectionContent({ content });
+                        });
+                    }
+                }
+            }
+        }
+        
+        // The caller renders the final content with its metadata
+        if (frame !== null) cancelAnimationFrame(frame);
+        
+        // No done event means the connection dropped mid-stream; the server only persists complete sections
+        const incomplete = Boolean(meta.incomplete) || !('model_used' in meta);
+        if (incomplete && !content) {
+            throw new Error('Stream ended before any content arrived');
+        }
+        return { ...meta, content, incomplete };
+    }
+    
+    showIncompleteWarning(retryAction) {
+        // Keep the partial text readable, but say it was cut off and offer the same retry as a failure
+        const contentContainer = document.getElementById('section-content-container');
+        contentContainer.insertAdjacentHTML('beforeend', `
+            <div class="error-message">
+                <h3>⚠️ Content may be incomplete</h3>
+                <p>Generation stopped partway through this section, so it was not saved.</p>
+                <button class="btn btn--primary" onclick="app.${retryAction}()">
+                    🔄 Retry
+                </button>
+            </div>
+        `);
+        this.showNotification('Content generation was interrupted. Please retry.', 'warning');
+    }
+    
     renderSectionContent(contentData, generationTime = null) {
         const contentContainer = document.getElementById('section-content-container');
         
@@ -415,19 +484,7 @@ class SpeedOptimizedAITutor {
         const startTime = Date.now();
         
         try {
-            const response = await fetch(`${this.apiBase}/api/regenerate-content`, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    topic: this.currentTopic,
-                    section_title: this.currentSection.title,
-                    section_index: this.currentSectionIndex,
-                    difficulty: this.settings.difficulty
-                }),
-                credentials: 'include'
-            });
-            
-            const contentData = await response.json();
+            const contentData = await this.streamSectionContent('/api/regenerate-content/stream');
             const elapsed = (Date.now() - startTime) / 1000;
             
             // Update generation time
@@ -435,6 +492,11 @@ class SpeedOptimizedAITutor {
             
             this.renderSectionContent(contentData, elapsed);
             
+            if (contentData.incomplete) {
+                this.showIncompleteWarning('regenerateSection');
+                return;
+            }
+            
             this.showNotification(`🔄⚡ Content regenerated in ${elapsed.toFixed(1)}s!`, 'success');
             console.log(`✅ Content regenerated in ${elapsed.toFixed(1)}s`);
         } catch (error) {